@@ -15,20 +15,34 @@
 # limitations under the License.
 
 import argparse
+import atexit
+import concurrent.futures
+import csv
+import hashlib
+import io
+import multiprocessing
+import math
+import socket
+import subprocess
+import tempfile
 import time
-import plumbum
+import paramiko
 import sys
-import statistics
 import os
 import collections
-from plumbum import local, SshMachine
+from plumbum import SshMachine
 
 
-ON_VM_WORKLOAD_PATH = '~/lsm-perf-workload'
+ON_VM_WORKLOAD_PREFIX = '~/lsm-perf-workload'
 ON_VM_WORKLOAD_CPU = 0
 HOST_PORT = 5555
-SSH_MAX_RETRY = 5
-QEMU_AFFINITY_PATH = './qemu-affinity/qemu_affinity.py'
+QMP_PORT = 4444
+SSH_READY_TIMEOUT = 10
+SSH_POLL_INTERVAL = 0.05
+MIN_RUNS = 10
+TARGET_REL_STDERR = 0.005
+VCPU_SPAWN_TIMEOUT = 5
+CPUS_PER_WORKER = 4
 
 
 """Holds the assignment of physical CPUs"""
@@ -46,21 +60,40 @@ def main(args):
         print('No dedicated CPUs provided.')
         alloc = None
 
+    workers = worker_count(len(args.kernels), alloc)
+    index_queue = multiprocessing.Queue()
+    for i in range(workers):
+        index_queue.put(i)
+
     try:
-        init_output_file(args.out, args.runs)
-        for round in range(args.rounds):
-            print('Starting round %d' % round)
-            for kernel in args.kernels:
-                results = evaluate_kernel(
+        # argparse.FileType cannot open the file with newline='', so
+        # force '\n' row endings to keep the historical output format
+        writer = csv.writer(args.out, lineterminator='\n')
+        init_output_file(writer, args.runs)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker,
+                initargs=(index_queue, workers, args.image.name)) as executor:
+            futures = [
+                executor.submit(
+                    evaluate_kernel_task,
                     kernel_path=kernel.name,
-                    filesystem_img_path=args.image.name,
                     workload_path=args.workload.name,
                     keyfile=args.key.name,
                     cpus=alloc,
                     runs=args.runs,
-                    warmups=args.warmups
+                    warmups=args.warmups,
+                    rounds=args.rounds,
+                    hugepages=args.hugepages
                 )
-                write_results_to_file(args.out, kernel.name, round, results)
+                for kernel in args.kernels
+            ]
+            # The parent process is the only writer, so rows do not
+            # need any further synchronization.
+            for future in concurrent.futures.as_completed(futures):
+                kernel_path, all_results = future.result()
+                for round, results in enumerate(all_results):
+                    write_results_to_file(
+                        writer, kernel_path, round, results)
     except KeyboardInterrupt:
         print('\nExit prematurely')
     finally:
@@ -68,10 +101,106 @@ def main(args):
     return 0
 
 
+def worker_count(kernel_count, cpu_allocation):
+    """Number of VMs that can reasonably run concurrently
+
+    Each VM gets `CPUS_PER_WORKER` host CPUs to itself. When a specific
+    CpuAllocation is requested, the evaluations all compete for the same
+    dedicated cores, so they have to run one at a time.
+    """
+    if cpu_allocation:
+        return 1
+    return max(1, min(kernel_count, (os.cpu_count() or 1) // CPUS_PER_WORKER))
+
+
+"""Ports used by the current worker process, set by `init_worker`"""
+worker_ports = {'ssh': HOST_PORT, 'qmp': QMP_PORT}
+
+"""Disk image used by the current worker process, set by `init_worker`"""
+worker_image = {'path': None, 'format': 'raw'}
+
+
+def init_worker(index_queue, workers, image_path):
+    """Assign a unique index to this worker process
+
+    The index determines the host ports forwarded to the VM (so that
+    concurrent VMs do not collide) and the slice of host CPUs this
+    worker is pinned to (so that concurrent VMs do not thrash each
+    other's cores).
+
+    Each worker also gets a private qcow2 overlay of the filesystem
+    image: qemu takes an exclusive write lock on its disk, so the
+    concurrent VMs cannot all open the raw image directly. The overlay
+    lives as long as the worker, so files the guests write (such as the
+    cached workload binary) persist across all the VMs of this worker
+    while the original image is never modified.
+    """
+    index = index_queue.get()
+    worker_ports['ssh'] = HOST_PORT + index
+    worker_ports['qmp'] = QMP_PORT + index
+
+    # The overlay lives next to the source image: the drive is opened
+    # with cache=none (O_DIRECT), which tmpfs (/tmp on many
+    # distributions) does not support, while the image's own
+    # filesystem evidently does.
+    image_path = os.path.abspath(image_path)
+    overlay = os.path.join(
+        os.path.dirname(image_path),
+        'lsm-perf-img-%d-%d.qcow2' % (os.getpid(), index))
+    subprocess.run(
+        ['qemu-img', 'create', '-q', '-f', 'qcow2',
+         '-b', image_path, '-F', 'raw', overlay],
+        check=True)
+    worker_image['path'] = overlay
+    worker_image['format'] = 'qcow2'
+    atexit.register(remove_worker_image)
+
+    available = sorted(os.sched_getaffinity(0))
+    share = len(available) // workers
+    if workers > 1 and share > 0:
+        mine = available[index * share:(index + 1) * share]
+        os.sched_setaffinity(0, set(mine))
+
+
+def remove_worker_image():
+    """Delete this worker's overlay image, if it still exists"""
+    try:
+        os.remove(worker_image['path'])
+    except FileNotFoundError:
+        pass
+
+
+def evaluate_kernel_task(kernel_path, workload_path,
+                         keyfile, cpus, runs, warmups, rounds,
+                         hugepages=False):
+    """Run `evaluate_kernel` in a worker, with its ports and overlay"""
+    results = evaluate_kernel(
+        kernel_path=kernel_path,
+        filesystem_img_path=worker_image['path'],
+        img_format=worker_image['format'],
+        workload_path=workload_path,
+        keyfile=keyfile,
+        cpus=cpus,
+        runs=runs,
+        warmups=warmups,
+        rounds=rounds,
+        hugepages=hugepages,
+        ssh_port=worker_ports['ssh'],
+        qmp_port=worker_ports['qmp']
+    )
+    return kernel_path, results
+
+
 def evaluate_kernel(kernel_path, filesystem_img_path, workload_path,
-                    keyfile, cpus, runs, warmups):
+                    keyfile, cpus, runs, warmups, rounds=1,
+                    ssh_port=HOST_PORT, qmp_port=QMP_PORT, hugepages=False,
+                    img_format='raw'):
     """Start a VM with the kernel and evaluates its performances
 
+    The VM is booted only once and reused for all the rounds, so the
+    qemu cold-start and the ssh connection are paid once per kernel
+    instead of once per (round, kernel) pair.
+
     :param kernel_path: Path of the kernel's bzImage
     :param filesystem_img_path: Path of the filesystem image (.img)
     :param workload_path: Path of the compiled workload program
@@ -79,39 +208,130 @@ def evaluate_kernel(kernel_path, filesystem_img_path, workload_path,
     :param cpus: CpuAllocation for qemu and the vm's cores,
                  or None to not assign CPUs
     :param runs: Number of measured executions of the workload
+                 in each round
     :param warmups: Number of unmeasured executions of the workload
                     before starting the measurements
-    :return: time measurements printed by each run of the workload
-    :rtype: list[int]
+    :param rounds: Number of times the measurements are repeated
+    :param ssh_port: host port forwarded to the VM's ssh port
+    :param qmp_port: host port for the VM's QMP socket
+    :param hugepages: back the VM's memory with host hugepages
+    :param img_format: qemu format of the filesystem image
+    :return: time measurements printed by each run of the workload,
+             one list per round
+    :rtype: list[list[int]]
     """
-    results = []
     name = os.path.basename(kernel_path)
     isolcpus = [ON_VM_WORKLOAD_CPU] if cpus else []
     print_eta(name, info='connecting')
-
-    with VM(kernel_path, filesystem_img_path, keyfile, cpus, isolcpus) as vm:
-        vm.scp_to(workload_path, ON_VM_WORKLOAD_PATH)
-
-        work_cmd = vm.ssh[ON_VM_WORKLOAD_PATH]
+    all_results = []
+
+    # The remote path is content-addressed, so a binary that is already
+    # on the image from a previous evaluation is never re-transferred.
+    workload_sha = hashlib.sha256(
+        prefetch_file(workload_path)).hexdigest()[:16]
+    on_vm_workload = '%s-%s' % (ON_VM_WORKLOAD_PREFIX, workload_sha)
+
+    with VM(kernel_path, filesystem_img_path, keyfile, cpus, isolcpus,
+            ssh_port=ssh_port, qmp_port=qmp_port, hugepages=hugepages,
+            prefetch=[workload_path], img_format=img_format) as vm:
+        present, _, _ = vm.shell.run('test -f %s' % on_vm_workload,
+                                     retcode=None)
+        if present != 0:
+            vm.scp_to(workload_path, on_vm_workload)
+
+        workload_cmd = on_vm_workload
         if cpus:
-            work_cmd = vm.ssh['taskset'][1 << ON_VM_WORKLOAD_CPU, work_cmd]
+            workload_cmd = ('taskset %d %s'
+                            % (1 << ON_VM_WORKLOAD_CPU, workload_cmd))
+        # Run all the repetitions in a single remote command, so that
+        # each of them does not pay a full ssh round-trip.
+        batch_cmd = vm.ssh['sh']['-c', 'for i in $(seq 1 %d); do %s; done'
+                                       % (runs, workload_cmd)]
 
         print_eta(name, info='Running warm up')
         for _ in range(warmups):
-            work_cmd()
-
-        for i in range(runs):
-            results.append(int(work_cmd().strip()))
-            percentage = (i + 1) * 100 / runs
-            print_eta(name, info='%d%%' % percentage)
+            vm.shell.run(workload_cmd)
 
-        vm.ssh.path(ON_VM_WORKLOAD_PATH).delete()
+        for round in range(rounds):
+            print_eta(name, info='Round %d: running %d repetitions'
+                                 % (round, runs))
+            results, mean, stdev = run_measured_batch(vm, batch_cmd)
+            all_results.append(results)
 
-    stats = ('\taverage=%d, stdev=%d' %
-             (statistics.mean(results), statistics.stdev(results)))
+    stats = '\taverage=%d, stdev=%d' % (mean, stdev)
     print_eta(name, info=stats)
     print()
-    return results
+    return all_results
+
+
+"""Cache of prefetched local files, keyed by (path, mtime, size)"""
+prefetched_files = {}
+
+
+def prefetch_file(path):
+    """Read a local file into memory, reusing previously read content
+
+    :param path: local path of the file to read
+    :return: the content of the file
+    :rtype: bytes
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in prefetched_files:
+        with open(path, 'rb') as file:
+            prefetched_files[key] = file.read()
+    return prefetched_files[key]
+
+
+def run_measured_batch(vm, batch_cmd):
+    """Collect the measurements streamed by the batched remote run
+
+    The mean and variance are accumulated online with Welford's
+    algorithm while the repetitions run. Once at least `MIN_RUNS`
+    samples are in and the relative standard error of the mean drops
+    below `TARGET_REL_STDERR`, the remaining repetitions are abandoned:
+    low-variance kernels converge with far fewer runs.
+
+    :param vm: the VM the batch runs on, inside a `with` block
+    :param batch_cmd: bound plumbum command printing one integer
+                      measurement per line
+    :return: the collected measurements, their mean and their stdev
+    :rtype: (list[int], float, float)
+    """
+    results = []
+    n, mean, m2 = 0, 0.0, 0.0
+    stopped_early = False
+    proc = batch_cmd.popen()
+    try:
+        for line in proc.stdout:
+            if not line.strip():
+                continue
+            # int() parses ASCII digits from bytes directly, tolerating
+            # the trailing newline, so the utf-8 decode and the str
+            # allocations are skipped for every sample
+            x = int(line)
+            results.append(x)
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+            if n >= MIN_RUNS and mean > 0:
+                stderr = math.sqrt(m2 / (n * (n - 1))) / mean
+                if stderr < TARGET_REL_STDERR:
+                    stopped_early = True
+                    break
+    finally:
+        proc.terminate()
+        proc.wait()
+    if stopped_early:
+        # terminate() only kills the local ssh client: without a pty,
+        # sshd leaves the remote loop running, and its remaining
+        # repetitions would contaminate the next round's measurements
+        vm.shell.run('pkill -f %s'
+                     % os.path.basename(ON_VM_WORKLOAD_PREFIX),
+                     retcode=None)
+    stdev = math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+    return results, mean, stdev
 
 
 class VM:
@@ -127,6 +347,10 @@ class VM:
 
     :ivar ssh: plumbum.SshMachine object, useful to run commands on
                the VM. It should only be used inside a `with` block.
+    :ivar shell: persistent remote shell session on the VM. Commands
+                 run through it reuse one long-lived channel instead of
+                 opening a new one per invocation. It should only be
+                 used inside a `with` block.
     :ivar process: popen process of qemu, useful to send signals
                    or input to qemu.
 
@@ -136,7 +360,9 @@ class VM:
     """
 
     def __init__(self, kernel_path, filesystem_img_path, keyfile,
-                 cpu_allocation=None, isolcpus=[]):
+                 cpu_allocation=None, isolcpus=[],
+                 ssh_port=HOST_PORT, qmp_port=QMP_PORT, hugepages=False,
+                 prefetch=[], img_format='raw'):
         """Start the qemu VM (non blocking)
 
         :param kernel_path: Path of the kernel's bzImage
@@ -145,80 +371,194 @@ class VM:
         :param cpu_allocation: CpuAllocation for qemu and the vm's cores,
                                or None to not assign CPUs
         :param isolcpus: list of CPU ID that should be isolated at boot time
+        :param ssh_port: host port forwarded to the VM's ssh port
+        :param qmp_port: host port for the VM's QMP socket
+        :param hugepages: back the VM's memory with host hugepages
+        :param prefetch: local paths that will be sent with `scp_to`,
+                         read into memory while the VM boots
+        :param img_format: qemu format of the filesystem image
         """
         qemu_args = VM.__construct_qemu_args(
             kernel_path=kernel_path,
             filesystem_img_path=filesystem_img_path,
-            isolcpus=isolcpus)
-        self.process = local['qemu-system-x86_64'].popen(qemu_args)
+            isolcpus=isolcpus,
+            ssh_port=ssh_port,
+            qmp_port=qmp_port,
+            hugepages=hugepages,
+            img_format=img_format)
+        # Launch through subprocess directly: without a preexec_fn,
+        # CPython spawns via vfork/posix_spawn instead of fork, which
+        # skips the page-table copy that grows with the parent's RSS.
+        # stderr goes to an unnamed temp file so it can be reported if
+        # qemu dies, without a pipe that would fill up otherwise.
+        self.__qemu_stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            ['qemu-system-x86_64'] + qemu_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self.__qemu_stderr,
+            start_new_session=True)
         self.ssh = None
+        self.sftp = None
+        self.shell = None
         self.key = keyfile
+        self.ssh_port = ssh_port
+        # Overlap the file reads with the VM boot
+        reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__prefetched = {path: reader.submit(prefetch_file, path)
+                             for path in prefetch}
+        reader.shutdown(wait=False)
         if cpu_allocation:
             VM.__qemu_affinity_setup(self.process.pid, cpu_allocation)
 
     def __enter__(self):
         """Initialize the ssh connection (blocks until success)"""
-        err = None
-        for _ in range(SSH_MAX_RETRY):
-            time.sleep(1)
-            try:
-                self.ssh = SshMachine(
-                    '127.0.0.1', user='root', port=HOST_PORT, keyfile=self.key)
-                break
-            except (EOFError, plumbum.machines.session.SSHCommsError) as e:
-                err = e
-                continue
-        else:  # Reached maximum retries
-            raise VMException(
-                'SSH connection failed after too many retries', err)
+        self.__wait_for_sshd()
+        # Multiplex every command over one persistent master
+        # connection, so each invocation skips the TCP and key
+        # exchange handshakes.
+        control_path = ('/tmp/lsm-perf-%d-%%r@%%h:%%p'
+                        % os.getpid())
+        self.ssh = SshMachine(
+            '127.0.0.1', user='root', port=self.ssh_port,
+            keyfile=self.key,
+            ssh_opts=['-o', 'ControlMaster=auto',
+                      '-o', 'ControlPath=%s' % control_path,
+                      '-o', 'ControlPersist=60s',
+                      # Every worker port is a new [127.0.0.1]:port
+                      # entry; accept its key without prompting, like
+                      # the paramiko AutoAddPolicy below
+                      '-o', 'StrictHostKeyChecking=accept-new'])
+        # One long-lived remote shell for the small bookkeeping
+        # commands, so they do not each open and close a channel.
+        self.shell = self.ssh.session()
+
+        # A single SFTP channel for all the file transfers, instead of
+        # forking (and re-authenticating) one scp per file.
+        self.__sftp_client = paramiko.SSHClient()
+        self.__sftp_client.set_missing_host_key_policy(
+            paramiko.AutoAddPolicy())
+        self.__sftp_client.connect(
+            '127.0.0.1', port=self.ssh_port, username='root',
+            key_filename=self.key)
+        self.sftp = self.__sftp_client.open_sftp()
         return self
 
+    def __wait_for_sshd(self):
+        """Block until the guest's sshd answers on the forwarded port
+
+        Qemu's user-mode networking listens on the forwarded host port
+        as soon as qemu starts, even before the guest is up, so a bare
+        connect() is not enough: the connection counts as ready only
+        once it produces an ssh protocol banner.
+        """
+        deadline = time.monotonic() + SSH_READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise VMException(
+                    'qemu exited with status %d: %s'
+                    % (self.process.returncode, self.__read_qemu_stderr()))
+            try:
+                with socket.create_connection(
+                        ('127.0.0.1', self.ssh_port),
+                        timeout=SSH_POLL_INTERVAL) as sock:
+                    sock.settimeout(10 * SSH_POLL_INTERVAL)
+                    if sock.recv(4).startswith(b'SSH'):
+                        return
+            except OSError:
+                pass
+            time.sleep(SSH_POLL_INTERVAL)
+        raise VMException(
+            'sshd did not come up within %ds' % SSH_READY_TIMEOUT)
+
+    def __read_qemu_stderr(self):
+        """Everything qemu wrote on stderr so far"""
+        self.__qemu_stderr.seek(0)
+        return self.__qemu_stderr.read().decode(errors='replace').strip()
+
     def __exit__(self, type, value, traceback):
         """Stop the SSH connection and the VM"""
+        if self.sftp is not None:
+            self.sftp.close()
+            self.__sftp_client.close()
+            self.sftp = None
+        if self.shell is not None:
+            self.shell.close()
+            self.shell = None
         if self.ssh is not None:
             self.ssh.close()
             self.ssh = None
         self.process.terminate()
+        self.__qemu_stderr.close()
 
     def scp_to(self, src_local, dst_remote):
         """Send a file from the host to the VM
 
         :param src_local: local path of the file to send
-        :param dst_remote: destination path on the vm
-        :raises ValueError: when the ssh connection is not established,
-                            i.e. when not used inside a `with` block
+        :param dst_remote: destination path on the vm, where `~/` refers
+                           to the remote user's home directory
+        :raises VMException: when the ssh connection is not established,
+                             i.e. when not used inside a `with` block
         """
-        if self.ssh is None:
+        if self.sftp is None:
             raise VMException(
                 '`VM.scp_to` must be used with an established SSH connection, '
                 'i.e. inside a `with` block.')
-        src = local.path(src_local)
-        dst = self.ssh.path(dst_remote)
-        plumbum.path.utils.copy(src, dst)
+        # SFTP resolves relative paths from the remote home directory
+        dst = dst_remote[2:] if dst_remote.startswith('~/') else dst_remote
+        if src_local in self.__prefetched:
+            data = self.__prefetched[src_local].result()
+            self.sftp.putfo(io.BytesIO(data), dst)
+        else:
+            self.sftp.put(src_local, dst)
+        self.sftp.chmod(dst, os.stat(src_local).st_mode & 0o777)
 
     @staticmethod
-    def __construct_qemu_args(kernel_path, filesystem_img_path, isolcpus=[]):
+    def __construct_qemu_args(kernel_path, filesystem_img_path, isolcpus=[],
+                              ssh_port=HOST_PORT, qmp_port=QMP_PORT,
+                              hugepages=False, img_format='raw'):
         """Qemu arguments similar to what `vm start` produces"""
         kernel_opt = ''
+        cpu_args = []
         if isolcpus:
             kernel_opt = ' isolcpus=' + ','.join(map(str, isolcpus))
+            # With dedicated host cores, let the guest idle without
+            # exiting to the host, so wakeup latency stays low.
+            cpu_args = ['-overcommit', 'cpu-pm=on']
+
+        machine_opt = 'accel=kvm'
+        memory_args = ['-m', '4G']
+        if hugepages:
+            # Backing the guest RAM with pre-allocated 2MiB pages makes
+            # the allocation faster and reduces EPT/TLB pressure during
+            # the measured workload.
+            machine_opt += ',memory-backend=mem'
+            memory_args += [
+                '-object', ('memory-backend-file,id=mem,size=4G,'
+                            'mem-path=/dev/hugepages,prealloc=on,share=on')
+            ]
 
         return [
             '-nographic',
             '-s',
-            '-machine', 'accel=kvm',
+            '-machine', machine_opt,
             '-cpu', 'host',
             '-device', 'e1000,netdev=net0',
-            '-netdev', 'user,id=net0,hostfwd=tcp::%d-:22' % HOST_PORT,
+            '-netdev', 'user,id=net0,hostfwd=tcp::%d-:22' % ssh_port,
             '-append',
                 'console=ttyS0,115200 root=/dev/sda rw nokaslr' + kernel_opt,
             '-smp', '2',
-            '-m', '4G',
-            '-drive', 'if=none,id=hd,file=%s,format=raw' % filesystem_img_path,
-            '-device', 'virtio-scsi-pci,id=scsi',
+        ] + cpu_args + memory_args + [
+            # io_uring submission plus a dedicated iothread keeps disk
+            # I/O off the vCPU threads and the aio=threads wakeup path
+            '-drive', ('if=none,id=hd,file=%s,format=%s,'
+                       'aio=io_uring,cache=none')
+                      % (filesystem_img_path, img_format),
+            '-object', 'iothread,id=iothread0',
+            '-device', 'virtio-scsi-pci,id=scsi,iothread=iothread0',
             '-device', 'scsi-hd,drive=hd',
             '-device', 'virtio-rng-pci,max-bytes=1024,period=1000',
-            '-qmp', 'tcp:localhost:4444,server,nowait',
+            '-qmp', 'tcp:localhost:%d,server,nowait' % qmp_port,
             '-serial', 'mon:stdio',
             '-kernel', '%s' % kernel_path,
             '-name', 'lsm_perf_vm,debug-threads=on'
@@ -226,14 +566,46 @@ class VM:
 
     @staticmethod
     def __qemu_affinity_setup(qemu_pid, cpu_alloc):
-        """Run qemu_affinity.py to allocate CPUs based on the CpuAllocation"""
-        system_affinities = ('-p %(sys)d -i *:%(sys)d -q %(sys)d -w *:%(sys)d'
-                             % {'sys': cpu_alloc.qemu_sys}).split(' ')
-        kvm_affinities = ['-k', str(cpu_alloc.host_kvm0),
-                                str(cpu_alloc.host_kvm1)]
-        args = system_affinities + kvm_affinities + ['--', str(qemu_pid)]
-        cmd = plumbum.cmd.sudo[sys.executable][QEMU_AFFINITY_PATH][args]
-        return cmd()
+        """Pin the qemu threads to the cores of the CpuAllocation
+
+        The vCPU threads (named 'CPU n/KVM') each get their dedicated
+        host_kvm core; every other qemu thread (main loop, iothreads,
+        workers) goes to the qemu_sys core. Qemu is our own child
+        process, so no elevated privileges are needed. The vCPU threads
+        are only created once the machine is initialized, so rescan
+        until both have been pinned.
+        """
+        vcpu_cores = {'CPU 0/KVM': cpu_alloc.host_kvm0,
+                      'CPU 1/KVM': cpu_alloc.host_kvm1}
+        deadline = time.monotonic() + VCPU_SPAWN_TIMEOUT
+        while time.monotonic() < deadline:
+            if VM.__pin_threads(qemu_pid, vcpu_cores,
+                                cpu_alloc.qemu_sys) == len(vcpu_cores):
+                return
+            time.sleep(SSH_POLL_INTERVAL)
+        raise VMException(
+            'qemu vCPU threads did not appear within %ds'
+            % VCPU_SPAWN_TIMEOUT)
+
+    @staticmethod
+    def __pin_threads(qemu_pid, vcpu_cores, default_core):
+        """Set the affinity of each qemu thread, based on its name
+
+        :return: the number of vCPU threads that were pinned
+        """
+        pinned_vcpus = 0
+        task_dir = '/proc/%d/task' % qemu_pid
+        for tid in os.listdir(task_dir):
+            try:
+                with open(os.path.join(task_dir, tid, 'comm')) as comm_file:
+                    comm = comm_file.read().strip()
+                core = vcpu_cores.get(comm, default_core)
+                os.sched_setaffinity(int(tid), {core})
+            except (FileNotFoundError, ProcessLookupError):
+                continue  # The thread exited while we were scanning
+            if comm in vcpu_cores:
+                pinned_vcpus += 1
+        return pinned_vcpus
 
 
 class VMException(Exception):
@@ -249,18 +621,16 @@ def print_eta(kernel_name, info=""):
     sys.stdout.flush()
 
 
-def init_output_file(file, runs):
+def init_output_file(writer, runs):
     """Writes the header in the result file"""
     columns = (['kernel path', 'round'] +
                ['run %d' % i for i in range(runs)])
-    file.write(','.join(columns) + '\n')
+    writer.writerow(columns)
 
 
-def write_results_to_file(file, kernel_path, round, results):
+def write_results_to_file(writer, kernel_path, round, results):
     """Writes the results of the evaluation of a kernel to the file"""
-    row = [kernel_path, round] + results
-    file.write(','.join(map(str, row)) + '\n')
-    file.flush()
+    writer.writerow([kernel_path, round] + results)
 
 
 def parse_args():
@@ -297,13 +667,20 @@ def parse_args():
               'be isolated (i.e. start your machine with '
               '`isolcpus=CPU-QEMU,CPU-KVM1,CPU-KVM2`. '
               'Omit this parameter to not assign CPUs'))
+    parser.add_argument(
+        '--hugepages', action='store_true',
+        help=('Back the VMs\' memory with 2MiB hugepages from '
+              '/dev/hugepages. This speeds up the VM memory allocation '
+              'and reduces TLB-related noise in the measurements, but '
+              'requires enough hugepages reserved on the host '
+              '(`sysctl vm.nr_hugepages`).'))
     parser.add_argument(
         '--runs', type=int, default=100,
         help=('Number of times the workload should be evaluated for each '
               'kernel in each round.'))
     parser.add_argument(
         '--rounds', type=int, default=5,
-        help='Number of times the tested are repeated and the VMs restarted.')
+        help='Number of times the tests are repeated on each VM.')
     parser.add_argument(
         '--warmups', type=int, default=5,
         help=('Number of times the workload will be run but not measured '
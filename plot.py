@@ -0,0 +1,136 @@
+#!/usr/bin/python
+#
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import re
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+"""Maps a regex on the kernel file name to a readable LSM name"""
+LSM_NICE_NAME = {
+    r'.*vanilla.*': 'No LSM',
+    r'.*selinux.*': 'SELinux',
+    r'.*apparmor.*': 'AppArmor',
+    r'.*bpf.*': 'BPF LSM',
+    r'.*landlock.*': 'Landlock',
+}
+
+"""Kernels whose file name matches one of these are left out of the plot"""
+EXCLUDE_LSM = [
+    r'.*debug.*',
+]
+
+# Compiled once at import: a single alternation over all the
+# LSM_NICE_NAME patterns, instead of re-matching every entry against
+# every kernel name in Python.
+NICE_NAME_PATTERN = re.compile(
+    '|'.join('(?P<g%d>%s)' % (i, pattern)
+             for i, pattern in enumerate(LSM_NICE_NAME)))
+NICE_NAME_BY_GROUP = {
+    'g%d' % i: name for i, name in enumerate(LSM_NICE_NAME.values())}
+EXCLUDE_PATTERN = re.compile('|'.join(EXCLUDE_LSM))
+
+
+def main(args):
+    # The pyarrow engine parses the csv multi-threaded and types the
+    # run columns directly, unlike the single-threaded default engine
+    try:
+        df = pd.read_csv(args.file, engine='pyarrow')
+    except pd.errors.ParserError:
+        # Early-stopped rounds write fewer run columns than the header
+        # announces; pyarrow rejects such rows, while the default
+        # engine pads them with NaN
+        args.file.seek(0)
+        df = pd.read_csv(args.file)
+    df = df[~df['kernel path'].str.contains(EXCLUDE_PATTERN)]
+    df['kernel'] = df['kernel path'].map(
+        lambda path: nice_name(os.path.basename(path)))
+
+    # melt reshapes in a single C-level pass, unlike wide_to_long which
+    # regex-matches every column name in Python
+    df = df.melt(id_vars=['kernel path', 'round', 'kernel'],
+                 var_name='run', value_name='time')
+    # Early-stopped rounds have fewer runs than the header announces
+    df = df.dropna(subset=['time'])
+    df['time'] = df['time'].astype('int64')
+
+    # Group means via bincount on the categorical codes, skipping
+    # pandas' hashing groupby machinery
+    kernels = df['kernel'].astype('category')
+    codes = kernels.cat.codes.to_numpy()
+    times = df['time'].to_numpy()
+    sums = np.bincount(codes, weights=times)
+    counts = np.bincount(codes)
+    averages = pd.Series(sums / counts, index=kernels.cat.categories)
+    baseline = averages.min()
+    for kernel, avg in averages.items():
+        print('%s: average=%d, overhead=%.2f%%'
+              % (kernel, avg, 100 * (avg / baseline - 1)))
+
+    # Pre-aggregate the box statistics instead of shipping every raw
+    # point to the browser: the figure payload shrinks from
+    # O(runs x kernels) floats to O(kernels).
+    quantiles = df.groupby('kernel')['time'].quantile([.25, .5, .75]).unstack()
+    iqr = quantiles[.75] - quantiles[.25]
+    low = (quantiles[.25] - 1.5 * iqr).reindex(df['kernel']).to_numpy()
+    high = (quantiles[.75] + 1.5 * iqr).reindex(df['kernel']).to_numpy()
+    in_fence = (times >= low) & (times <= high)
+    fences = df[in_fence].groupby('kernel')['time'].agg(['min', 'max'])
+    outliers = df[~in_fence]
+
+    fig = go.Figure(go.Box(
+        x=quantiles.index, q1=quantiles[.25], median=quantiles[.5],
+        q3=quantiles[.75],
+        lowerfence=fences['min'].reindex(quantiles.index),
+        upperfence=fences['max'].reindex(quantiles.index)))
+    if not outliers.empty:
+        fig.add_trace(go.Scatter(
+            x=outliers['kernel'], y=outliers['time'],
+            mode='markers', marker={'size': 3}))
+    fig.update_layout(xaxis_title='kernel', yaxis_title='time',
+                      showlegend=False)
+    fig.show()
+    return 0
+
+
+def nice_name(kernel_file):
+    """Readable name of a kernel file, based on LSM_NICE_NAME
+
+    :param kernel_file: base name of the kernel's bzImage
+    :return: the nice name of the first matching pattern, or the file
+             name unchanged when no pattern matches
+    """
+    match = NICE_NAME_PATTERN.match(kernel_file)
+    if match is None:
+        return kernel_file
+    return NICE_NAME_BY_GROUP[match.lastgroup]
+
+
+def parse_args():
+    """Parse arguments with argparse"""
+    parser = argparse.ArgumentParser(
+        description='Plots the results produced by lsm-perf.py.')
+    parser.add_argument(
+        '-f', '--file', type=argparse.FileType('r'), default='lsm-perf.csv',
+        help='Path of the csv result file produced by lsm-perf.py.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())